@@ -14,6 +14,8 @@ try:
     import pyfftw
     fft = pyfftw.interfaces.numpy_fft
     pyfftw.interfaces.cache.enable()
+    # The default of 0.1 s drops the plans between partitions
+    pyfftw.interfaces.cache.set_keepalive_time(60)
     zeros = pyfftw.zeros_aligned
 except ImportError:
     fft = np.fft
@@ -104,7 +106,70 @@ def peak_elevation(center, corrmap, height, r_min=1.5, r_max=np.float('inf')):
     return max(0, result)
 
 
-def do_correlations(template, crop_parts):
+CORRELATION_EXPONENTS = {
+    'cc': 0,
+    'hybrid': 0.5,
+    'phase': 1,
+}
+
+
+def check_correlation_mode(correlation_mode, supported=CORRELATION_EXPONENTS):
+    '''
+    Raise :code:`ValueError` if :code:`correlation_mode` is not one of :code:`supported`.
+
+    .. versionadded:: 0.5.0.dev0
+
+    Parameters
+    ----------
+    correlation_mode : str
+        Correlation mode to check
+    supported : Iterable[str], optional
+        Supported correlation modes, default all modes of :meth:`normalize_spectrum`
+    '''
+    if correlation_mode not in supported:
+        raise ValueError(
+            "Unsupported correlation mode %s. Supported are %s" % (
+                correlation_mode, ", ".join(supported)
+            )
+        )
+
+
+def normalize_spectrum(spec, correlation_mode):
+    '''
+    Normalize the product of template and data spectrum in place
+    according to the correlation mode.
+
+    The spectrum is divided by its amplitude to the power of 0 for cross correlation
+    (:code:`'cc'`, no change), 0.5 for hybrid correlation (:code:`'hybrid'`) or 1 for
+    phase correlation (:code:`'phase'`). Phase and hybrid correlation give sharper
+    correlation peaks, which can help to separate close peaks.
+
+    .. versionadded:: 0.5.0.dev0
+
+    Parameters
+    ----------
+    spec : numpy.ndarray
+        Complex spectrum, modified in place
+    correlation_mode : {'cc', 'hybrid', 'phase'}
+        Correlation mode
+
+    Returns
+    -------
+    spec : numpy.ndarray
+    '''
+    check_correlation_mode(correlation_mode)
+    exponent = CORRELATION_EXPONENTS[correlation_mode]
+    if exponent != 0:
+        amplitude = np.abs(spec)
+        # Avoid division by zero. Bins with zero amplitude stay zero.
+        np.maximum(amplitude, np.finfo(amplitude.dtype).tiny, out=amplitude)
+        if exponent != 1:
+            amplitude **= exponent
+        spec /= amplitude
+    return spec
+
+
+def do_correlations(template, crop_parts, correlation_mode='cc'):
     '''
     Calculate the correlation of the pre-calculated template with a stack
     of cropped peaks using fast correlation.
@@ -117,15 +182,25 @@ def do_correlations(template, crop_parts):
         the real Fourier transform (fft.rfft2) of the source pattern has a different shape!
     crop_parts : numpy.ndarray
         Stack of peaks cropped from the frame.
+    correlation_mode : {'cc', 'hybrid', 'phase'}, optional
+        :code:`'cc'` (default) for cross correlation, :code:`'phase'` for phase correlation
+        or :code:`'hybrid'` for hybrid correlation. See :meth:`normalize_spectrum`.
+
+        .. versionadded:: 0.5.0.dev0
 
     Returns
     -------
     corrs : numpy.ndarray
         Correlation of the correlation pattern and the peaks.
     '''
-    spec_parts = fft.rfft2(crop_parts)
-    corrspecs = template * spec_parts
-    corrs = fft.fftshift(fft.irfft2(corrspecs), axes=(-1, -2))
+    # Multiply in place to avoid allocating another stack of spectra
+    spec_parts = fft.rfft2(crop_parts, axes=(-2, -1))
+    spec_parts *= template
+    normalize_spectrum(spec_parts, correlation_mode)
+    corrs = fft.fftshift(
+        fft.irfft2(spec_parts, s=crop_parts.shape[-2:], axes=(-2, -1)),
+        axes=(-1, -2)
+    )
     return corrs
 
 
@@ -149,18 +224,66 @@ def evaluate_correlations(corrs, peaks, crop_size,
     for i in range(len(corrs)):
         corr = corrs[i]
         center = unravel_index(np.argmax(corr), corr.shape)
-        refined = np.array(refine_center(center, 2, corr), dtype=np.float32)
+        refined = refine_center(center, 2, corr)
         height = np.float32(corr[center])
-        out_centers[i] = _shift(np.array(center), peaks[i], crop_size)
-        out_refineds[i] = _shift(refined, peaks[i], crop_size)
+        # Write y and x separately to avoid temporary arrays per peak
+        offset_y = peaks[i, 0] - crop_size
+        offset_x = peaks[i, 1] - crop_size
+        out_centers[i, 0] = center[0] + offset_y
+        out_centers[i, 1] = center[1] + offset_x
+        out_refineds[i, 0] = refined[0] + offset_y
+        out_refineds[i, 1] = refined[1] + offset_x
         out_heights[i] = height
         out_elevations[i] = np.float32(peak_elevation(refined, corr, height))
 
 
+@numba.njit
+def evaluate_correlations_frames(corrmaps, peaks, crop_size,
+        out_centers, out_refineds, out_heights, out_elevations):
+    '''
+    Apply :meth:`evaluate_correlations` to a stack of frames
+
+    .. versionadded:: 0.5.0.dev0
+
+    Parameters
+    ----------
+    corrmaps : numpy.ndarray
+        Correlation maps of shape (n_frames, n_peaks, y, x)
+    peaks : numpy.ndarray
+        List of peaks of shape (n_peaks, 2), the same for all frames
+    crop_size : int
+        Offset of the peak position within the correlation maps
+    out_centers, out_refineds, out_heights, out_elevations : numpy.ndarray
+        Output buffers with an additional leading frame dimension
+        in comparison to :meth:`evaluate_correlations`
+    '''
+    for f in range(len(corrmaps)):
+        evaluate_correlations(
+            corrs=corrmaps[f], peaks=peaks, crop_size=crop_size,
+            out_centers=out_centers[f], out_refineds=out_refineds[f],
+            out_heights=out_heights[f], out_elevations=out_elevations[f]
+        )
+
+
 def log_scale(data, out):
     return np.log(data - np.min(data) + 1, out=out)
 
 
+@numba.njit
+def log_scale_transpose(data, out):
+    '''
+    Same as :code:`log_scale(data.T, out)` for 2D data in a single pass,
+    without temporary arrays.
+
+    .. versionadded:: 0.5.0.dev0
+    '''
+    m = np.min(data) - 1
+    for j in range(data.shape[1]):
+        for i in range(data.shape[0]):
+            out[j, i] = np.log(data[i, j] - m)
+    return out
+
+
 def log_scale_cropbufs_inplace(crop_bufs):
     m = np.min(crop_bufs, axis=(-1, -2)) - 1
     np.log(crop_bufs - m[:, np.newaxis, np.newaxis], out=crop_bufs)
@@ -168,38 +291,143 @@ def log_scale_cropbufs_inplace(crop_bufs):
 
 @numba.njit
 def crop_disks_from_frame(peaks, frame, crop_size, out_crop_bufs):
-
-    def frame_coord_y(peak, y):
-        return y + peak[0] - crop_size
-
-    def frame_coord_x(peak, x):
-        return x + peak[1] - crop_size
-
     fy, fx = frame.shape
+    h, w = out_crop_bufs.shape[1:]
     for i in range(len(peaks)):
-        peak = peaks[i]
-        for y in range(out_crop_bufs.shape[1]):
-            yy = frame_coord_y(peak, y)
-            y_outside = yy < 0 or yy >= fy
-            for x in range(out_crop_bufs.shape[2]):
-                xx = frame_coord_x(peak, x)
-                x_outside = xx < 0 or xx >= fx
-                if y_outside or x_outside:
-                    out_crop_bufs[i, y, x] = 0
-                else:
-                    out_crop_bufs[i, y, x] = frame[yy, xx]
+        top = peaks[i, 0] - crop_size
+        left = peaks[i, 1] - crop_size
+        # Clamp the crop to the frame once per peak instead of
+        # checking the bounds for each pixel
+        y_start = max(0, -top)
+        y_stop = min(h, fy - top)
+        x_start = max(0, -left)
+        x_stop = min(w, fx - left)
+        if y_stop <= y_start or x_stop <= x_start:
+            out_crop_bufs[i] = 0
+            continue
+        out_crop_bufs[i, :y_start] = 0
+        out_crop_bufs[i, y_stop:] = 0
+        out_crop_bufs[i, y_start:y_stop, :x_start] = 0
+        out_crop_bufs[i, y_start:y_stop, x_stop:] = 0
+        out_crop_bufs[i, y_start:y_stop, x_start:x_stop] = frame[
+            top + y_start:top + y_stop, left + x_start:left + x_stop
+        ]
 
 
 @numba.njit
-def _shift(relative_center, anchor, crop_size):
-    return relative_center + anchor - np.array((crop_size, crop_size))
+def sparse_template_coords(peaks, steps, crop_size, template, sig_shape):
+    '''
+    COO coordinates and values of a mask stack that stamps :code:`template`
+    at all correlation steps around each peak, clipped to the frame.
+
+    Mask :code:`(p * (2 * steps + 1) + dy + steps) * (2 * steps + 1) + dx + steps`
+    stamps the template with its top left corner at :code:`peaks[p] + (dy, dx) - crop_size`.
 
+    .. versionadded:: 0.5.0.dev0
 
-def get_buf_count(crop_size, n_peaks, dtype, limit=2**19):
+    Parameters
+    ----------
+    peaks : numpy.ndarray
+        Integer peak positions of shape (n_peaks, 2)
+    steps : int
+        Number of correlation steps in each direction
+    crop_size : int
+        Offset of the peak position within the template
+    template : numpy.ndarray
+        2D template
+    sig_shape : Tuple[int, int]
+        Shape of the frame
+
+    Returns
+    -------
+    coords : numpy.ndarray
+        Mask index, y and x coordinate of each entry, shape (3, n_entries)
+    data : numpy.ndarray
+        Template value of each entry
+    '''
+    ty, tx = template.shape
+    fy, fx = sig_shape
+    n_steps = 2 * steps + 1
+    # First pass: count the entries within the frame to allocate exactly
+    count = 0
+    for p in range(len(peaks)):
+        for sy in range(n_steps):
+            top = peaks[p, 0] + sy - steps - crop_size
+            h = min(ty, fy - top) - max(0, -top)
+            if h <= 0:
+                continue
+            for sx in range(n_steps):
+                left = peaks[p, 1] + sx - steps - crop_size
+                w = min(tx, fx - left) - max(0, -left)
+                if w > 0:
+                    count += h * w
+    coords = np.empty((3, count), dtype=np.int64)
+    data = np.empty(count, dtype=template.dtype)
+    i = 0
+    for p in range(len(peaks)):
+        for sy in range(n_steps):
+            top = peaks[p, 0] + sy - steps - crop_size
+            for sx in range(n_steps):
+                left = peaks[p, 1] + sx - steps - crop_size
+                index = (p * n_steps + sy) * n_steps + sx
+                for y in range(max(0, -top), min(ty, fy - top)):
+                    for x in range(max(0, -left), min(tx, fx - left)):
+                        coords[0, i] = index
+                        coords[1, i] = top + y
+                        coords[2, i] = left + x
+                        data[i] = template[y, x]
+                        i += 1
+    return coords, data
+
+
+def next_fast_len(n):
+    '''
+    Smallest even 5-smooth number that is larger or equal to :code:`n`.
+
+    FFT back-ends are fastest for sizes that only have the prime factors 2, 3
+    and 5. Zero-padding to such a size keeps the transform on the fast code
+    paths. The result is even so that :code:`fftshift` maps the center of a
+    pattern back to the center.
+
+    .. versionadded:: 0.5.0.dev0
+
+    Parameters
+    ----------
+    n : int
+        Minimum size
+
+    Returns
+    -------
+    int
+
+    Example
+    -------
+
+    >>> next_fast_len(28)
+    30
+    >>> next_fast_len(128)
+    128
+    '''
+    n = max(2, int(n))
+    while True:
+        if n % 2 == 0:
+            remainder = n
+            for p in (2, 3, 5):
+                while remainder % p == 0:
+                    remainder //= p
+            if remainder == 1:
+                return n
+        n += 1
+
+
+def get_buf_count(crop_size, n_peaks, dtype, limit=2**19, fft_size=None):
     '''
     Calculate the optimal number of peaks in a stack to fit
     within the limit.
 
+    .. versionchanged:: 0.5.0.dev0
+        Parameter :code:`fft_size`
+
     Parameters
     ----------
     crop_size : int
@@ -210,23 +438,31 @@ def get_buf_count(crop_size, n_peaks, dtype, limit=2**19):
         dtype of the data for size calculation
     limit : int, optional
         Upper limit, default 1/2 MB to be L3 cache friendly
+    fft_size : int, optional
+        Size of the cropped parts if they are zero-padded for the FFT.
+        Default 2 * crop_size.
 
     Returns
     -------
     int
     '''
+    if fft_size is None:
+        fft_size = 2 * crop_size
     dtype = np.dtype(dtype)
-    full_size = (2 * crop_size)**2 * dtype.itemsize
+    full_size = fft_size**2 * dtype.itemsize
     return min(max(1, limit // full_size), n_peaks)
 
 
-def allocate_crop_bufs(crop_size, n_peaks, dtype, limit=2**19):
+def allocate_crop_bufs(crop_size, n_peaks, dtype, limit=2**19, fft_size=None):
     '''
     Allocate buffer for stack of cropped peaks
 
     The size is optimized to fit within :code:`limit`. An aligned buffer for the FFT
     back-end is created if possible.
 
+    .. versionchanged:: 0.5.0.dev0
+        Parameter :code:`fft_size`
+
     Parameters
     ----------
     crop_size : int
@@ -237,20 +473,25 @@ def allocate_crop_bufs(crop_size, n_peaks, dtype, limit=2**19):
         dtype of the buffer
     limit : int, optional
         Upper limit, default 1/2 MB to be L3 cache friendly
+    fft_size : int, optional
+        Zero-pad the cropped parts to this size for the FFT. Default 2 * crop_size.
+        :meth:`next_fast_len` calculates a suitable size.
 
     Returns
     -------
     crop_bufs: np.ndarray
-        Shape (n, 2*crop_size, 2*crop_size)
+        Shape (n, fft_size, fft_size)
     '''
-    buf_count = get_buf_count(crop_size, n_peaks, dtype, limit)
-    crop_bufs = zeros((buf_count, 2 * crop_size, 2 * crop_size), dtype=dtype)
+    if fft_size is None:
+        fft_size = 2 * crop_size
+    buf_count = get_buf_count(crop_size, n_peaks, dtype, limit, fft_size=fft_size)
+    crop_bufs = zeros((buf_count, fft_size, fft_size), dtype=dtype)
     return crop_bufs
 
 
 def process_frame_fast(template, crop_size, frame, peaks,
         out_centers, out_refineds, out_heights, out_elevations,
-        crop_bufs):
+        crop_bufs, correlation_mode='cc'):
     '''
     Find the parameters of peaks in a diffraction pattern by correlation with a template
 
@@ -266,8 +507,11 @@ def process_frame_fast(template, crop_size, frame, peaks,
     ----------
     template : numpy.ndarray
         Real Fourier transform of the correlation pattern.
-        The source pattern should have size (2 * crop_size, 2 * crop_size). Please note that
+        The source pattern should have the size of a crop buffer, i.e. (2 * crop_size,
+        2 * crop_size) or the padded FFT size of :code:`crop_bufs`. Please note that
         the real Fourier transform (fft.rfft2) of the source pattern has a different shape!
+        If :code:`crop_bufs` are padded, use the same size as :code:`fft_shape` for
+        :meth:`~libertem_blobfinder.common.patterns.MatchPattern.get_template`.
     crop_size : int
         Half the size of the correlation pattern. Given as a parameter since real Fourier
         transform changes the size.
@@ -284,9 +528,15 @@ def process_frame_fast(template, crop_size, frame, peaks,
     out_elevations : np.ndarray
         Output buffer for peak elevation in log scaled frame. Shape (n_peaks, ) and float dtype.
     crop_bufs : np.ndarray
-        Aligned buffer for pyfftw. Shape (n, 2 * crop_size, 2 * crop_size) and float dtype.
+        Aligned buffer for pyfftw. Shape (n, s, s) with s >= 2 * crop_size and float dtype.
         n doesn't have to match the number of peaks. Instead, it should be chosen for good L3 cache
-        efficiency. :meth:`allocate_crop_bufs` can be used to allocate this buffer.
+        efficiency. s can be larger than 2 * crop_size to zero-pad to a fast FFT size.
+        :meth:`allocate_crop_bufs` can be used to allocate this buffer.
+    correlation_mode : {'cc', 'hybrid', 'phase'}, optional
+        :code:`'cc'` (default) for cross correlation, :code:`'phase'` for phase correlation
+        or :code:`'hybrid'` for hybrid correlation. See :meth:`normalize_spectrum`.
+
+        .. versionadded:: 0.5.0.dev0
 
     Returns
     -------
@@ -297,19 +547,25 @@ def process_frame_fast(template, crop_size, frame, peaks,
     -------
 
     >>> from libertem_blobfinder.common.patterns import RadialGradient
-    >>> from libertem_blobfinder.base.correlation import allocate_crop_bufs
+    >>> from libertem_blobfinder.base.correlation import allocate_crop_bufs, next_fast_len
     >>>
     >>> frames, indices, peaks = libertem.utils.generate.cbed_frame(radius=4)
     >>> pattern = RadialGradient(radius=4)
     >>> crop_size = pattern.get_crop_size()
-    >>> template = pattern.get_template(sig_shape=(2 * crop_size, 2 * crop_size))
+    >>> # Optional: zero-pad to a fast FFT size. The template and the
+    >>> # crop buffers have to use the same size.
+    >>> fft_size = next_fast_len(2 * crop_size)
+    >>> template = pattern.get_template(
+    ...     sig_shape=(2 * crop_size, 2 * crop_size),
+    ...     fft_shape=(fft_size, fft_size),
+    ... )
     >>>
     >>> centers = np.zeros((len(frames), len(peaks), 2), dtype=np.uint16)
     >>> refineds = np.zeros((len(frames), len(peaks), 2), dtype=np.float32)
     >>> heights = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     >>> elevations = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     >>>
-    >>> crop_bufs = allocate_crop_bufs(crop_size, len(peaks), frames.dtype)
+    >>> crop_bufs = allocate_crop_bufs(crop_size, len(peaks), frames.dtype, fft_size=fft_size)
     >>>
     >>> for i, f in enumerate(frames):
     ...     process_frame_fast(
@@ -323,18 +579,21 @@ def process_frame_fast(template, crop_size, frame, peaks,
     '''
     buf_count = len(crop_bufs)
     block_count = (len(peaks) - 1) // buf_count + 1
+    # Any padding beyond 2 * crop_size stays zero, which is the
+    # minimum of the log-scaled crop
+    crop = slice(0, 2 * crop_size)
     for block in range(block_count):
         start = block * buf_count
         stop = min((block + 1) * buf_count, len(peaks))
         size = stop - start
         crop_disks_from_frame(
             peaks=peaks[start:stop], frame=frame, crop_size=crop_size,
-            out_crop_bufs=crop_bufs[:size]
+            out_crop_bufs=crop_bufs[:size, crop, crop]
         )
-        log_scale_cropbufs_inplace(crop_bufs[:size])
-        corrs = do_correlations(template, crop_bufs[:size])
+        log_scale_cropbufs_inplace(crop_bufs[:size, crop, crop])
+        corrs = do_correlations(template, crop_bufs[:size], correlation_mode)
         evaluate_correlations(
-            corrs=corrs, peaks=peaks[start:stop], crop_size=crop_size,
+            corrs=corrs[:, crop, crop], peaks=peaks[start:stop], crop_size=crop_size,
             out_centers=out_centers[start:stop], out_refineds=out_refineds[start:stop],
             out_heights=out_heights[start:stop], out_elevations=out_elevations[start:stop]
         )
@@ -358,8 +617,10 @@ def process_frame_full(template, crop_size, frame, peaks,
     ----------
     template : numpy.ndarray
         Real Fourier transform of the correlation pattern.
-        The source pattern should have size (2 * crop_size, 2 * crop_size). Please note that
+        The source pattern should have the shape of :code:`frame_buf`. Please note that
         the real Fourier transform (fft.rfft2) of the source pattern has a different shape!
+        If :code:`frame_buf` is padded, use its shape as :code:`fft_shape` for
+        :meth:`~libertem_blobfinder.common.patterns.MatchPattern.get_template`.
     crop_size : int
         Half the size of the correlation pattern. Given as a parameter since real Fourier
         transform changes the size.
@@ -380,13 +641,13 @@ def process_frame_full(template, crop_size, frame, peaks,
         Output buffer for peak elevation in log scaled frame. Shape (n_peaks, ) and float dtype.
         Will be allocated if needed.
     frame_buf : np.ndarray
-        Aligned buffer for FFT back-end, such as pyfftw. Shape of a frame and float dtype.
-        :meth:`libertem_blobfinder.base.correlation.zero` can be used.
+        Aligned buffer for FFT back-end, such as pyfftw. Shape of a frame or larger
+        to zero-pad to a fast FFT size, and float dtype.
+        :meth:`libertem_blobfinder.base.correlation.zeros` can be used.
     buf_count : int
         Number of peaks to process per outer loop iteration. This allows optimization of L3 cache
         efficiency.
 
-
     Returns
     -------
     None
@@ -396,19 +657,22 @@ def process_frame_full(template, crop_size, frame, peaks,
     -------
 
     >>> from libertem_blobfinder.common.patterns import RadialGradient
-    >>> from libertem_blobfinder.base.correlation import get_buf_count, zeros
+    >>> from libertem_blobfinder.base.correlation import get_buf_count, zeros, next_fast_len
     >>>
     >>> frames, indices, peaks = libertem.utils.generate.cbed_frame()
     >>> pattern = RadialGradient(radius=4)
     >>> crop_size = pattern.get_crop_size()
-    >>> template = pattern.get_template(sig_shape=frames[0].shape)
+    >>> # Optional: zero-pad to a fast FFT size. The template and the
+    >>> # frame buffer have to use the same shape.
+    >>> fft_shape = tuple(next_fast_len(s) for s in frames[0].shape)
+    >>> template = pattern.get_template(sig_shape=frames[0].shape, fft_shape=fft_shape)
     >>>
     >>> centers = np.zeros((len(frames), len(peaks), 2), dtype=np.uint16)
     >>> refineds = np.zeros((len(frames), len(peaks), 2), dtype=np.float32)
     >>> heights = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     >>> elevations = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     >>>
-    >>> frame_buf = zeros(frames[0].shape, dtype=np.float32)
+    >>> frame_buf = zeros(fft_shape, dtype=np.float32)
     >>> buf_count = get_buf_count(crop_size, len(peaks), frame_buf.dtype)
     >>>
     >>> for i, f in enumerate(frames):
@@ -421,10 +685,12 @@ def process_frame_full(template, crop_size, frame, peaks,
     ...     )
     >>> assert np.allclose(refineds[0], peaks, atol=0.1)
     '''
-    log_scale(frame, out=frame_buf)
+    fy, fx = frame.shape
+    # Any padding stays zero, which is the minimum of the log-scaled frame
+    log_scale(frame, out=frame_buf[:fy, :fx])
     spec_part = fft.rfft2(frame_buf)
-    corrspec = template * spec_part
-    corr = fft.fftshift(fft.irfft2(corrspec))
+    spec_part *= template
+    corr = fft.fftshift(fft.irfft2(spec_part, s=frame_buf.shape))[:fy, :fx]
     crop_bufs = np.zeros((buf_count, 2 * crop_size, 2 * crop_size), dtype=corr.dtype)
     block_count = (len(peaks) - 1) // buf_count + 1
     for block in range(block_count):
@@ -67,7 +67,7 @@ def get_peaks(sum_result, match_pattern: MatchPattern, num_peaks):
     return peaks
 
 
-def process_frames_fast(pattern: MatchPattern, frames, peaks):
+def process_frames_fast(pattern: MatchPattern, frames, peaks, correlation_mode='cc'):
     '''
     Find the parameters of peaks in a diffraction pattern by correlation with a match pattern.
 
@@ -86,6 +86,11 @@ def process_frames_fast(pattern: MatchPattern, frames, peaks):
         Frame data. Currently, only Real values are supported.
     peaks : np.ndarray
         List of peaks of shape (n_peaks, 2)
+    correlation_mode : {'cc', 'hybrid', 'phase'}, optional
+        Cross correlation (default), hybrid or phase correlation, see
+        :meth:`libertem_blobfinder.base.correlation.normalize_spectrum`.
+
+        .. versionadded:: 0.5.0.dev0
 
     Returns
     -------
@@ -111,14 +116,20 @@ def process_frames_fast(pattern: MatchPattern, frames, peaks):
     >>> assert np.allclose(refineds[0], peaks, atol=0.1)
     '''
     crop_size = pattern.get_crop_size()
-    template = pattern.get_template(sig_shape=(2 * crop_size, 2 * crop_size))
+    fft_size = base.correlation.next_fast_len(2 * crop_size)
+    template = pattern.get_template(
+        sig_shape=(2 * crop_size, 2 * crop_size),
+        fft_shape=(fft_size, fft_size),
+    )
 
     centers = np.zeros((len(frames), len(peaks), 2), dtype=np.uint16)
     refineds = np.zeros((len(frames), len(peaks), 2), dtype=np.float32)
     heights = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     elevations = np.zeros((len(frames), len(peaks)), dtype=np.float32)
 
-    crop_bufs = base.correlation.allocate_crop_bufs(crop_size, len(peaks), frames.dtype)
+    crop_bufs = base.correlation.allocate_crop_bufs(
+        crop_size, len(peaks), frames.dtype, fft_size=fft_size
+    )
 
     for i, f in enumerate(frames):
         base.correlation.process_frame_fast(
@@ -126,12 +137,12 @@ def process_frames_fast(pattern: MatchPattern, frames, peaks):
             frame=f, peaks=peaks.astype(np.int32),
             out_centers=centers[i], out_refineds=refineds[i],
             out_heights=heights[i], out_elevations=elevations[i],
-            crop_bufs=crop_bufs
+            crop_bufs=crop_bufs, correlation_mode=correlation_mode,
         )
     return (centers, refineds, heights, elevations)
 
 
-def process_frames_full(pattern: MatchPattern, frames, peaks):
+def process_frames_full(pattern: MatchPattern, frames, peaks, correlation_mode='cc'):
     '''
     Find the parameters of peaks in a diffraction pattern by correlation with a match pattern.
 
@@ -151,6 +162,13 @@ def process_frames_full(pattern: MatchPattern, frames, peaks):
         Frame data. Currently, only real values are supported.
     peaks : np.ndarray
         List of peaks of shape (n_peaks, 2)
+    correlation_mode : {'cc'}, optional
+        Only cross correlation is supported for full frames. Hybrid and phase
+        correlation amplify spectral components that the sparse spectrum of a
+        full diffraction pattern doesn't carry, which produces spurious maxima.
+        Use :meth:`process_frames_fast` for these modes.
+
+        .. versionadded:: 0.5.0.dev0
 
     Returns
     -------
@@ -175,15 +193,18 @@ def process_frames_full(pattern: MatchPattern, frames, peaks):
     ... )
     >>> assert np.allclose(refineds[0], peaks, atol=0.1)
     '''
+    base.correlation.check_correlation_mode(correlation_mode, supported=('cc', ))
     crop_size = pattern.get_crop_size()
-    template = pattern.get_template(sig_shape=frames[0].shape)
+    sig_shape = frames[0].shape
+    fft_shape = tuple(base.correlation.next_fast_len(s) for s in sig_shape)
+    template = pattern.get_template(sig_shape=sig_shape, fft_shape=fft_shape)
 
     centers = np.zeros((len(frames), len(peaks), 2), dtype=np.uint16)
     refineds = np.zeros((len(frames), len(peaks), 2), dtype=np.float32)
     heights = np.zeros((len(frames), len(peaks)), dtype=np.float32)
     elevations = np.zeros((len(frames), len(peaks)), dtype=np.float32)
 
-    frame_buf = base.correlation.zeros(frames[0].shape, dtype=np.float32)
+    frame_buf = base.correlation.zeros(fft_shape, dtype=np.float32)
 
     buf_count = base.correlation.get_buf_count(crop_size, len(peaks), frame_buf.dtype)
 
@@ -193,6 +214,6 @@ def process_frames_full(pattern: MatchPattern, frames, peaks):
             frame=f, peaks=peaks.astype(np.int32),
             out_centers=centers[i], out_refineds=refineds[i],
             out_heights=heights[i], out_elevations=elevations[i],
-            frame_buf=frame_buf, buf_count=buf_count
+            frame_buf=frame_buf, buf_count=buf_count,
         )
     return (centers, refineds, heights, elevations)
@@ -29,8 +29,32 @@ class MatchPattern:
     def get_mask(self, sig_shape):
         raise NotImplementedError
 
-    def get_template(self, sig_shape):
-        return fft.rfft2(self.get_mask(sig_shape))
+    def get_template(self, sig_shape, fft_shape=None):
+        '''
+        Real Fourier transform of the mask for :code:`sig_shape`.
+
+        .. versionchanged:: 0.5.0.dev0
+            Parameter :code:`fft_shape`
+
+        Parameters
+        ----------
+
+        sig_shape : Tuple[int, int]
+            Shape of the mask
+        fft_shape : Tuple[int, int], optional
+            Zero-pad the mask to this shape before the transform, keeping its
+            center at :code:`fft_shape // 2`. This allows to use sizes that FFT
+            back-ends process fast, see
+            :meth:`libertem_blobfinder.base.correlation.next_fast_len`.
+        '''
+        mask = self.get_mask(sig_shape)
+        if fft_shape is not None and tuple(fft_shape) != tuple(sig_shape):
+            padded = np.zeros(fft_shape, dtype=mask.dtype)
+            top = fft_shape[0] // 2 - sig_shape[0] // 2
+            left = fft_shape[1] // 2 - sig_shape[1] // 2
+            padded[top:top + sig_shape[0], left:left + sig_shape[1]] = mask
+            mask = padded
+        return fft.rfft2(mask)
 
 
 class Circular(MatchPattern):
@@ -1,16 +1,32 @@
 import functools
 
 import numpy as np
+import sparse
 
 from libertem.udf import UDF
-import libertem.masks as masks
 from libertem.common.container import MaskContainer
+from libertem.common.buffers import AuxBufferWrapper
 
 from libertem_blobfinder.common.patterns import MatchPattern
 import libertem_blobfinder.base.correlation as ltbc
 from libertem_blobfinder.common.correlation import get_peaks
 
 
+def _sparse_correlation_stack(peaks, steps, crop_size, template, sig_shape):
+    '''
+    Mask stack for :class:`SparseCorrelationUDF`, see
+    :meth:`libertem_blobfinder.base.correlation.sparse_template_coords`.
+    '''
+    coords, data = ltbc.sparse_template_coords(
+        peaks=peaks, steps=steps, crop_size=crop_size, template=template,
+        sig_shape=sig_shape,
+    )
+    return sparse.COO(
+        coords=coords, data=data,
+        shape=(len(peaks) * (2 * steps + 1)**2, *sig_shape)
+    )
+
+
 class CorrelationUDF(UDF):
     '''
     Base class for peak correlation implementations
@@ -26,6 +42,9 @@ class CorrelationUDF(UDF):
             Zero shift, for example descan error. Can be :code:`None`, :code:`numpy.array((y, x))`
             or AUX data with :code:`(y, x)` for each frame.
         '''
+        # self.params only gives access to the data of AUX buffers, not the
+        # buffer itself, so we determine the kind of zero shift here
+        self.per_frame_zero_shift = isinstance(zero_shift, AuxBufferWrapper)
         super().__init__(peaks=np.round(peaks).astype(int), zero_shift=zero_shift, *args, **kwargs)
 
     def get_result_buffers(self):
@@ -88,13 +107,58 @@ class CorrelationUDF(UDF):
             result = self.params.zero_shift[index]
         return result
 
+    def get_static_shifted_peaks(self):
+        '''
+        Peak positions with the zero shift applied if the zero shift is the
+        same for all frames, :code:`None` for a per-frame zero shift.
+
+        Call this in :meth:`get_task_data` to calculate the shifted peaks only
+        once per partition.
+
+        .. versionadded:: 0.5.0.dev0
+        '''
+        if self.per_frame_zero_shift:
+            return None
+        else:
+            return self.get_peaks() + np.round(self.get_zero_shift()).astype(int)
+
+    def get_shift_task_data(self):
+        '''
+        Task data for :meth:`get_shifted_peaks`: The static shifted peaks
+        from :meth:`get_static_shifted_peaks` and scratch buffers to apply
+        a per-frame zero shift without allocating.
+
+        Merge the result into the return value of :meth:`get_task_data`.
+
+        .. versionadded:: 0.5.0.dev0
+        '''
+        return {
+            'shifted_peaks': self.get_static_shifted_peaks(),
+            'shifted_peaks_buf': np.empty_like(self.get_peaks()),
+            'zero_shift_buf': np.empty(2, dtype=np.float64),
+        }
+
+    def get_shifted_peaks(self):
+        '''
+        Peak positions with the zero shift of the current frame applied
+        '''
+        peaks = self.task_data.shifted_peaks
+        if peaks is None:
+            zero_shift = np.round(self.get_zero_shift(), out=self.task_data.zero_shift_buf)
+            peaks = np.add(
+                self.get_peaks(), zero_shift,
+                out=self.task_data.shifted_peaks_buf, casting='unsafe'
+            )
+        return peaks
+
 
 class FastCorrelationUDF(CorrelationUDF):
     '''
     Fourier-based fast correlation-based refinement of peak positions within a search frame
     for each peak.
     '''
-    def __init__(self, peaks, match_pattern, zero_shift=None, *args, **kwargs):
+    def __init__(self, peaks, match_pattern, zero_shift=None, correlation_mode='cc',
+            *args, **kwargs):
         '''
         Parameters
         ----------
@@ -106,13 +170,20 @@ class FastCorrelationUDF(CorrelationUDF):
         zero_shift : Union[AUXBufferWrapper, numpy.ndarray, None], optional
             Zero shift, for example descan error. Can be :code:`None`, :code:`numpy.array((y, x))`
             or AUX data with :code:`(y, x)` for each frame.
+        correlation_mode : {'cc', 'hybrid', 'phase'}, optional
+            Cross correlation (default), hybrid or phase correlation, see
+            :meth:`libertem_blobfinder.base.correlation.normalize_spectrum`.
+
+            .. versionadded:: 0.5.0.dev0
         '''
+        ltbc.check_correlation_mode(correlation_mode)
         # For testing purposes, allow to inject a different limit via
         # an internal kwarg
         # It has to come through kwarg because of how UDFs are run
         self.limit = kwargs.get('__limit', 2**19)  # 1/2 MB
         super().__init__(
-            peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift, *args, **kwargs
+            peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift,
+            correlation_mode=correlation_mode, *args, **kwargs
         )
 
     def get_task_data(self):
@@ -120,13 +191,28 @@ class FastCorrelationUDF(CorrelationUDF):
         n_peaks = len(self.get_peaks())
         mask = self.get_pattern()
         crop_size = mask.get_crop_size()
-        template = mask.get_template(sig_shape=(2 * crop_size, 2 * crop_size))
+        fft_size = ltbc.next_fast_len(2 * crop_size)
+        template = mask.get_template(
+            sig_shape=(2 * crop_size, 2 * crop_size),
+            fft_shape=(fft_size, fft_size),
+        )
         dtype = np.result_type(self.meta.input_dtype, np.float32)
-        crop_bufs = ltbc.allocate_crop_bufs(crop_size, n_peaks, dtype=dtype, limit=self.limit)
+        crop_bufs = ltbc.allocate_crop_bufs(
+            crop_size, n_peaks, dtype=dtype, limit=self.limit, fft_size=fft_size
+        )
         kwargs = {
             'crop_bufs': crop_bufs,
             'template': template,
+            # Bind the arguments that are constant within a partition once
+            'correlate': functools.partial(
+                ltbc.process_frame_fast,
+                template=template,
+                crop_size=crop_size,
+                crop_bufs=crop_bufs,
+                correlation_mode=self.params.correlation_mode,
+            ),
         }
+        kwargs.update(self.get_shift_task_data())
         return kwargs
 
     def get_pattern(self):
@@ -136,14 +222,11 @@ class FastCorrelationUDF(CorrelationUDF):
         return self.task_data.template
 
     def process_frame(self, frame):
-        match_pattern = self.get_pattern()
         (centers, refineds, peak_values, peak_elevations) = self.output_buffers()
-        ltbc.process_frame_fast(
-            template=self.get_template(), crop_size=match_pattern.get_crop_size(),
-            frame=frame, peaks=self.get_peaks() + np.round(self.get_zero_shift()).astype(np.int),
+        self.task_data.correlate(
+            frame=frame, peaks=self.get_shifted_peaks(),
             out_centers=centers, out_refineds=refineds,
             out_heights=peak_values, out_elevations=peak_elevations,
-            crop_bufs=self.task_data.crop_bufs
         )
 
 
@@ -157,7 +240,8 @@ class FullFrameCorrelationUDF(CorrelationUDF):
 
     .. versionadded:: 0.3.0
     '''
-    def __init__(self, peaks, match_pattern, zero_shift=None, *args, **kwargs):
+    def __init__(self, peaks, match_pattern, zero_shift=None, correlation_mode='cc',
+            *args, **kwargs):
         '''
         Parameters
         ----------
@@ -169,29 +253,52 @@ class FullFrameCorrelationUDF(CorrelationUDF):
         zero_shift : Union[AUXBufferWrapper, numpy.ndarray, None], optional
             Zero shift, for example descan error. Can be :code:`None`, :code:`numpy.array((y, x))`
             or AUX data with :code:`(y, x)` for each frame.
+        correlation_mode : {'cc'}, optional
+            Only cross correlation is supported for full frames, see
+            :meth:`libertem_blobfinder.common.correlation.process_frames_full`.
+            Use :class:`FastCorrelationUDF` for hybrid or phase correlation.
+
+            .. versionadded:: 0.5.0.dev0
         '''
+        ltbc.check_correlation_mode(correlation_mode, supported=('cc', ))
         # For testing purposes, allow to inject a different limit via
         # an internal kwarg
         # It has to come through kwarg because of how UDFs are run
         self.limit = kwargs.get('__limit', 2**19)  # 1/2 MB
 
         super().__init__(
-            peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift, *args, **kwargs
+            peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift,
+            correlation_mode=correlation_mode, *args, **kwargs
         )
 
     def get_task_data(self):
         ""
         mask = self.get_pattern()
         n_peaks = len(self.params.peaks)
-        template = mask.get_template(sig_shape=self.meta.dataset_shape.sig)
+        sig_shape = tuple(self.meta.dataset_shape.sig)
+        fft_shape = tuple(ltbc.next_fast_len(s) for s in sig_shape)
+        template = mask.get_template(sig_shape=sig_shape, fft_shape=fft_shape)
         dtype = np.result_type(self.meta.input_dtype, np.float32)
-        frame_buf = ltbc.zeros(shape=self.meta.dataset_shape.sig, dtype=dtype)
+        frame_buf = ltbc.zeros(shape=fft_shape, dtype=dtype)
         crop_size = mask.get_crop_size()
+        # The crop buffers for the correlation result are not padded
+        buf_count = ltbc.get_buf_count(
+            crop_size, n_peaks, dtype, self.limit, fft_size=2 * crop_size
+        )
         kwargs = {
             'template': template,
             'frame_buf': frame_buf,
-            'buf_count': ltbc.get_buf_count(crop_size, n_peaks, dtype, self.limit),
+            'buf_count': buf_count,
+            # Bind the arguments that are constant within a partition once
+            'correlate': functools.partial(
+                ltbc.process_frame_full,
+                template=template,
+                crop_size=crop_size,
+                frame_buf=frame_buf,
+                buf_count=buf_count,
+            ),
         }
+        kwargs.update(self.get_shift_task_data())
         return kwargs
 
     def get_pattern(self):
@@ -201,19 +308,14 @@ class FullFrameCorrelationUDF(CorrelationUDF):
         return self.task_data.template
 
     def process_frame(self, frame):
-        match_pattern = self.get_pattern()
         (centers, refineds, peak_values, peak_elevations) = self.output_buffers()
-        ltbc.process_frame_full(
-            template=self.get_template(),
-            crop_size=match_pattern.get_crop_size(),
+        self.task_data.correlate(
             frame=frame,
-            peaks=self.get_peaks() + np.round(self.get_zero_shift()).astype(np.int),
+            peaks=self.get_shifted_peaks(),
             out_centers=centers,
             out_refineds=refineds,
             out_heights=peak_values,
             out_elevations=peak_elevations,
-            frame_buf=self.task_data.frame_buf,
-            buf_count=self.task_data.buf_count,
         )
 
 
@@ -268,22 +370,13 @@ class SparseCorrelationUDF(CorrelationUDF):
         size = (2 * crop_size + 1, 2 * crop_size + 1)
         template = match_pattern.get_mask(sig_shape=size)
         steps = self.params.steps
-        peak_offsetY, peak_offsetX = np.mgrid[-steps:steps + 1, -steps:steps + 1]
-
-        offsetY = self.params.peaks[:, 0, np.newaxis, np.newaxis] + peak_offsetY - crop_size
-        offsetX = self.params.peaks[:, 1, np.newaxis, np.newaxis] + peak_offsetX - crop_size
-
-        offsetY = offsetY.flatten()
-        offsetX = offsetX.flatten()
-
         stack = functools.partial(
-            masks.sparse_template_multi_stack,
-            mask_index=range(len(offsetY)),
-            offsetX=offsetX,
-            offsetY=offsetY,
+            _sparse_correlation_stack,
+            peaks=self.params.peaks,
+            steps=steps,
+            crop_size=crop_size,
             template=template,
-            imageSizeX=self.meta.dataset_shape.sig[1],
-            imageSizeY=self.meta.dataset_shape.sig[0]
+            sig_shape=tuple(self.meta.dataset_shape.sig),
         )
         # CSC matrices in combination with transposed data are fastest
         container = MaskContainer(mask_factories=stack, dtype=np.float32,
@@ -292,19 +385,29 @@ class SparseCorrelationUDF(CorrelationUDF):
         kwargs = {
             'mask_container': container,
             'crop_size': crop_size,
+            # Scratch buffers for the transposed, log-scaled tile by shape
+            'tile_bufs': {},
+            # Mask stack slices by signal slice
+            'mask_slices': {},
         }
         return kwargs
 
     def process_tile(self, tile):
         tile_slice = self.meta.slice
         c = self.task_data.mask_container
-        tile_t = np.zeros(
-            (np.prod(tile.shape[1:]), tile.shape[0]),
-            dtype=tile.dtype
-        )
-        ltbc.log_scale(tile.reshape((tile.shape[0], -1)).T, out=tile_t)
-
-        sl = c.get(key=tile_slice, transpose=False)
+        shape = (np.prod(tile.shape[1:]), tile.shape[0])
+        tile_bufs = self.task_data.tile_bufs
+        tile_t = tile_bufs.get(shape)
+        if tile_t is None or tile_t.dtype != tile.dtype:
+            tile_t = tile_bufs[shape] = np.empty(shape, dtype=tile.dtype)
+        ltbc.log_scale_transpose(tile.reshape((tile.shape[0], -1)), out=tile_t)
+
+        sig_dims = tile_slice.shape.sig.dims
+        key = (tuple(tile_slice.origin[-sig_dims:]), tuple(tile_slice.shape.sig))
+        mask_slices = self.task_data.mask_slices
+        sl = mask_slices.get(key)
+        if sl is None:
+            sl = mask_slices[key] = c.get(key=tile_slice, transpose=False)
         self.results.corr[:] += sl.dot(tile_t).T
 
     def postprocess(self):
@@ -322,17 +425,16 @@ class SparseCorrelationUDF(CorrelationUDF):
         ))
         peaks = self.params.peaks
         (centers, refineds, peak_values, peak_elevations) = self.output_buffers()
-        for f in range(corrmaps.shape[0]):
-            ltbc.evaluate_correlations(
-                corrs=corrmaps[f], peaks=peaks, crop_size=self.params.steps,
-                out_centers=centers[f], out_refineds=refineds[f],
-                out_heights=peak_values[f], out_elevations=peak_elevations[f]
-            )
+        ltbc.evaluate_correlations_frames(
+            corrmaps=corrmaps, peaks=peaks, crop_size=self.params.steps,
+            out_centers=centers, out_refineds=refineds,
+            out_heights=peak_values, out_elevations=peak_elevations
+        )
 
 
 def run_fastcorrelation(
         ctx, dataset, peaks, match_pattern: MatchPattern, zero_shift=None, roi=None,
-        progress=False):
+        progress=False, correlation_mode='cc'):
     """
     Wrapper function to construct and run a :class:`FastCorrelationUDF`
 
@@ -350,6 +452,11 @@ def run_fastcorrelation(
         Boolean mask of the navigation dimension to select region of interest (ROI)
     progress : bool, optional
         Show progress bar
+    correlation_mode : {'cc', 'hybrid', 'phase'}, optional
+        Cross correlation (default), hybrid or phase correlation, see
+        :meth:`libertem_blobfinder.base.correlation.normalize_spectrum`.
+
+        .. versionadded:: 0.5.0.dev0
 
     Returns
     -------
@@ -357,7 +464,10 @@ def run_fastcorrelation(
         See :meth:`CorrelationUDF.get_result_buffers` for details.
     """
     peaks = peaks.astype(np.int)
-    udf = FastCorrelationUDF(peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift)
+    udf = FastCorrelationUDF(
+        peaks=peaks, match_pattern=match_pattern, zero_shift=zero_shift,
+        correlation_mode=correlation_mode,
+    )
     return ctx.run_udf(dataset=dataset, udf=udf, roi=roi, progress=progress)
 
 
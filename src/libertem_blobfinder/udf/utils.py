@@ -1,5 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+from matplotlib.collections import EllipseCollection, LineCollection, PatchCollection
 
 import libertem.analysis.gridmatching as grm
 
@@ -17,9 +19,12 @@ def visualize_frame(ctx, ds, result, indices, r, y, x, axes, colors=None, stretc
     else:
         select = (y, x)
 
+    # astype() returns a copy that we can scale in place
     d = sample_frame[0].raw_data.astype(np.float32)
+    d -= np.min(d)
+    np.log1p(d, out=d)
 
-    pcm = axes.imshow(np.log(d - np.min(d) + 1))
+    pcm = axes.imshow(d)
 
     refined = result['refineds'].data[select]
     elevations = result['peak_elevations'].data[select]
@@ -69,15 +74,39 @@ def paint_markers(axes, r, refined, normalized_elevations, calculated, selector,
 
     # Plot markers for the individual peak positions.
     # The alpha channel represents the peak elevation, which is used as a weight in the fit.
-    for i in range(len(refined)):
-        p = np.flip(refined[i])
-        a = max(0, normalized_elevations[i])
-        p0 = np.flip(calculated[i])
-        if selector[i]:
-            axes.add_artist(plt.Circle(p, r, color=colors['marker'], fill=False, alpha=a))
-            axes.add_artist(plt.Circle(p0, 1, color=colors['arrow'], fill=True, alpha=a))
-            axes.arrow(*p0, *(p-p0)*stretch, color=colors['arrow'], alpha=a)
-        else:
-            (yy, xx) = calculated[i]
-            xy = (xx - r, yy - r)
-            axes.add_artist(plt.Rectangle(xy, 2*r, 2*r, color=colors['missing'], fill=False))
+    # All markers of a kind are submitted as one collection since adding
+    # individual artists is slow for many peaks.
+    selector = np.asarray(selector, dtype=bool)
+    alphas = np.clip(normalized_elevations, 0, 1)[selector]
+    p = np.flip(refined[selector], axis=-1)
+    p0 = np.flip(calculated[selector], axis=-1)
+
+    if len(p):
+        marker_colors = _rgba(colors['marker'], alphas)
+        arrow_colors = _rgba(colors['arrow'], alphas)
+        axes.add_collection(EllipseCollection(
+            widths=2*r, heights=2*r, angles=0, units='xy',
+            offsets=p, transOffset=axes.transData,
+            facecolors='none', edgecolors=marker_colors,
+        ), autolim=False)
+        axes.add_collection(EllipseCollection(
+            widths=2, heights=2, angles=0, units='xy',
+            offsets=p0, transOffset=axes.transData,
+            facecolors=arrow_colors, edgecolors=arrow_colors,
+        ), autolim=False)
+        segments = np.stack((p0, p0 + (p - p0)*stretch), axis=1)
+        axes.add_collection(LineCollection(segments, colors=arrow_colors))
+
+    missing = calculated[~selector]
+    if len(missing):
+        axes.add_collection(PatchCollection(
+            [plt.Rectangle((xx - r, yy - r), 2*r, 2*r) for (yy, xx) in missing],
+            facecolors='none', edgecolors=colors['missing'],
+        ), autolim=False)
+
+
+def _rgba(color, alphas):
+    result = np.empty((len(alphas), 4))
+    result[:] = mcolors.to_rgba(color)
+    result[:, 3] = alphas
+    return result
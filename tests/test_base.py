@@ -99,3 +99,91 @@ def test_com():
     com = base.correlation.center_of_mass(data)
     print(ref, com, np.array(ref) - np.array(com))
     assert np.allclose(ref, com)
+
+
+def test_next_fast_len():
+    def is_fast(size):
+        for p in (2, 3, 5):
+            while size % p == 0:
+                size //= p
+        return size == 1
+
+    for n in range(1, 300):
+        size = base.correlation.next_fast_len(n)
+        assert size >= n
+        assert size % 2 == 0
+        assert is_fast(size)
+        for smaller in range(n, size):
+            assert smaller % 2 or not is_fast(smaller)
+
+
+@pytest.mark.with_numba
+def test_evaluate_correlations_frames():
+    n_frames, n_peaks, crop_size = 3, 4, 3
+    corrmaps = np.random.random((n_frames, n_peaks, 2*crop_size + 1, 2*crop_size + 1))
+    peaks = np.random.randint(low=crop_size, high=64, size=(n_peaks, 2))
+
+    def allocate():
+        return (
+            np.zeros((n_frames, n_peaks, 2), dtype=np.uint16),
+            np.zeros((n_frames, n_peaks, 2), dtype=np.float32),
+            np.zeros((n_frames, n_peaks), dtype=np.float32),
+            np.zeros((n_frames, n_peaks), dtype=np.float32),
+        )
+
+    ref = allocate()
+    for f in range(n_frames):
+        base.correlation.evaluate_correlations(
+            corrmaps[f], peaks, crop_size, *(r[f] for r in ref)
+        )
+
+    res = allocate()
+    base.correlation.evaluate_correlations_frames(corrmaps, peaks, crop_size, *res)
+
+    for r, rr in zip(ref, res):
+        assert np.allclose(r, rr)
+
+
+def test_buf_count_padded():
+    crop_size = 13
+    fft_size = base.correlation.next_fast_len(2 * crop_size)
+    assert fft_size == 30
+    nbytes = fft_size**2 * np.dtype(np.float32).itemsize
+    limit = 10 * nbytes + 1
+
+    count = base.correlation.get_buf_count(crop_size, 100, np.float32, limit, fft_size=fft_size)
+    assert count == 10
+
+    bufs = base.correlation.allocate_crop_bufs(
+        crop_size, 100, np.float32, limit, fft_size=fft_size
+    )
+    assert bufs.shape == (10, fft_size, fft_size)
+    assert bufs.nbytes <= limit
+
+
+@pytest.mark.with_numba
+def test_log_scale_transpose():
+    data = _mk_random(size=(7, 13), dtype="float32")
+    ref = base.correlation.log_scale(data.T, out=None)
+    out = np.empty((13, 7), dtype=np.float32)
+    base.correlation.log_scale_transpose(data, out=out)
+    assert np.allclose(ref, out)
+
+
+def test_normalize_spectrum():
+    spec = np.fft.rfft2(np.random.random((8, 8)))
+    spec[0, 1] = 0
+
+    cc = base.correlation.normalize_spectrum(spec.copy(), 'cc')
+    assert np.allclose(cc, spec)
+
+    phase = base.correlation.normalize_spectrum(spec.copy(), 'phase')
+    assert np.allclose(np.abs(phase[spec != 0]), 1)
+    assert phase[0, 1] == 0
+
+    hybrid = base.correlation.normalize_spectrum(spec.copy(), 'hybrid')
+    assert np.allclose(np.abs(hybrid), np.sqrt(np.abs(spec)))
+    assert np.allclose(np.angle(hybrid[spec != 0]), np.angle(spec[spec != 0]))
+
+    with pytest.raises(ValueError):
+        base.correlation.normalize_spectrum(spec, 'foo')
@@ -63,6 +63,22 @@ def test_custom_template_fuzz():
         mask = custom.get_mask((mask_y, mask_x))  # noqa
 
 
+def test_template_fft_shape():
+    pattern = common.patterns.RadialGradient(radius=7)
+    sig_shape = (28, 27)
+    fft_shape = (30, 30)
+    mask = pattern.get_mask(sig_shape)
+    template = pattern.get_template(sig_shape=sig_shape, fft_shape=fft_shape)
+    padded = np.fft.irfft2(template, s=fft_shape)
+
+    assert np.allclose(padded[1:29, 2:29], mask)
+    assert np.allclose(padded.sum(), mask.sum())
+    assert np.allclose(
+        pattern.get_template(sig_shape=sig_shape, fft_shape=sig_shape),
+        pattern.get_template(sig_shape=sig_shape),
+    )
+
+
 def test_featurevector(lt_ctx):
     shape = np.array([128, 128])
     zero = shape // 2
@@ -201,3 +217,32 @@ def test_standalone_full():
         print(peaks - refineds)
 
         assert np.allclose(refineds[0], peaks, atol=0.5)
+
+
+@pytest.mark.with_numba
+def test_standalone_padded():
+    # Sizes that are not 5-smooth, so that the frame and crop buffers are padded
+    shape = np.array([127, 134])
+    zero = shape / 2 + np.random.uniform(-1, 1, size=2)
+    a = np.array([34.3, 0.]) + np.random.uniform(-1, 1, size=2)
+    b = np.array([0., 42.19]) + np.random.uniform(-1, 1, size=2)
+    indices = np.mgrid[-2:3, -2:3]
+    indices = np.concatenate(indices.T)
+
+    radius = 7
+
+    data, indices, peaks = cbed_frame(*shape, zero, a, b, indices, radius)
+
+    match_pattern = common.patterns.RadialGradient(radius=radius, search=radius*2)
+
+    for process in (
+            common.correlation.process_frames_fast,
+            common.correlation.process_frames_full):
+        (centers, refineds, heights, elevations) = process(
+            pattern=match_pattern,
+            frames=data, peaks=peaks.astype(np.int32),
+        )
+
+        print(peaks - refineds)
+
+        assert np.allclose(refineds[0], peaks, atol=0.5)
@@ -14,6 +14,7 @@ import libertem_blobfinder.common.patterns
 import libertem_blobfinder.udf.refinement
 import libertem_blobfinder.udf.correlation
 import libertem_blobfinder.udf.utils  # noqa F401
+import libertem_blobfinder.base.correlation  # noqa F401
 
 from utils import _mk_random
 
@@ -277,7 +278,12 @@ def test_run_refine_blocktests(lt_ctx, cls):
 
     # The crop buffer is float32
     # FIXME adapt as soon as UDFs have dtype support
-    nbytes = (2*crop_size)**2 * np.dtype(np.float32).itemsize
+    if cls is udf.correlation.FastCorrelationUDF:
+        # Padded to a fast FFT size
+        size = libertem_blobfinder.base.correlation.next_fast_len(2*crop_size)
+    else:
+        size = 2*crop_size
+    nbytes = size**2 * np.dtype(np.float32).itemsize
 
     for limit in (
             1,
@@ -377,6 +383,7 @@ def test_correlation_methods(lt_ctx, cls, dtype, kwargs):
     [
         (udf.correlation.FullFrameCorrelationUDF, np.int, {}),
         (udf.correlation.FullFrameCorrelationUDF, np.float, {}),
+        (udf.correlation.FullFrameCorrelationUDF, np.float, {'zero_shift': (2, 3)}),
     ]
 )
 def test_correlation_method_fullframe(lt_ctx, cls, dtype, kwargs):
@@ -482,6 +489,24 @@ def test_visualize_smoke(navshape, lt_ctx):
     # plt.show()
 
 
+@pytest.mark.parametrize(
+    "selected", [True, False]
+)
+def test_paint_markers_uniform_selector(selected):
+    calculated = np.array([(10., 12.), (30., 35.), (50., 51.)])
+    refined = calculated + np.random.uniform(-1, 1, size=calculated.shape)
+    fig, axes = plt.subplots()
+    udf.utils.paint_markers(
+        axes=axes, r=4, refined=refined,
+        normalized_elevations=np.array([1., 0.5, -0.1]),
+        calculated=calculated,
+        selector=np.full(len(calculated), selected),
+        zero=np.array((30., 35.)), a=np.array((20., 0.)), b=np.array((0., 16.)),
+    )
+    fig.canvas.draw()
+    plt.close(fig)
+
+
 def test_run_refine_fastmatch_zeroshift(lt_ctx):
     shape = np.array([128, 128])
     zero = shape / 2 + np.random.uniform(-1, 1, size=2)
@@ -546,3 +571,166 @@ def test_run_refine_fastmatch_zeroshift(lt_ctx):
         assert np.allclose(res['zero'].data[1], zero + shift, atol=0.5)
         assert np.allclose(res['a'].data, a, atol=0.2)
         assert np.allclose(res['b'].data, b, atol=0.2)
+
+
+def test_run_refine_fullframe_zeroshift(lt_ctx):
+    shape = np.array([128, 128])
+    zero = shape / 2 + np.random.uniform(-1, 1, size=2)
+    a = np.array([27.17, 0.]) + np.random.uniform(-1, 1, size=2)
+    b = np.array([0., 29.19]) + np.random.uniform(-1, 1, size=2)
+    indices = np.mgrid[-2:3, -2:3]
+    indices = np.concatenate(indices.T)
+
+    radius = 10
+    # Exactly between peaks, worst case
+    shift = (a + b) / 2
+
+    data_0, indices_0, peaks_0 = cbed_frame(*shape, zero, a, b, indices, radius)
+    data_1, indices_1, peaks_1 = cbed_frame(*shape, zero + shift, a, b, indices, radius)
+
+    data = np.concatenate((data_0, data_1), axis=0)
+
+    dataset = MemoryDataSet(data=data, tileshape=(1, *shape),
+                            num_partitions=1, sig_dims=2)
+    matcher = grm.Matcher()
+    match_pattern = common.patterns.RadialGradient(radius=radius)
+
+    zero_shift = np.array([(0., 0.), shift]).astype(np.float32)
+    (res, real_indices) = udf.refinement.run_refine(
+        ctx=lt_ctx,
+        dataset=dataset,
+        zero=zero + np.random.uniform(-0.5, 0.5, size=2),
+        a=a + np.random.uniform(-0.5, 0.5, size=2),
+        b=b + np.random.uniform(-0.5, 0.5, size=2),
+        matcher=matcher,
+        match_pattern=match_pattern,
+        correlation='fullframe',
+        zero_shift=UDF.aux_data(zero_shift, kind='nav', extra_shape=(2,))
+    )
+
+    assert np.allclose(res['zero'].data[0], zero, atol=0.5)
+    assert np.allclose(res['zero'].data[1], zero + shift, atol=0.5)
+    assert np.allclose(res['a'].data, a, atol=0.2)
+    assert np.allclose(res['b'].data, b, atol=0.2)
+
+
+@pytest.mark.with_numba
+def test_sparse_correlation_stack():
+    sig_shape = (40, 50)
+    steps = 2
+    # Include peaks close to and beyond the border to test clipping
+    peaks = np.array([(0, 0), (20, 25), (39, 49), (-3, 10), (45, 52)])
+    match_pattern = common.patterns.RadialGradient(radius=4)
+    crop_size = match_pattern.get_crop_size()
+    template = match_pattern.get_mask(sig_shape=(2 * crop_size + 1, 2 * crop_size + 1))
+
+    offsetY, offsetX = np.mgrid[-steps:steps + 1, -steps:steps + 1]
+    offsetY = (peaks[:, 0, np.newaxis, np.newaxis] + offsetY - crop_size).flatten()
+    offsetX = (peaks[:, 1, np.newaxis, np.newaxis] + offsetX - crop_size).flatten()
+    ref = m.sparse_template_multi_stack(
+        mask_index=range(len(offsetY)), offsetX=offsetX, offsetY=offsetY,
+        template=template, imageSizeX=sig_shape[1], imageSizeY=sig_shape[0]
+    )
+
+    stack = udf.correlation._sparse_correlation_stack(
+        peaks=peaks, steps=steps, crop_size=crop_size, template=template,
+        sig_shape=sig_shape
+    )
+    assert stack.shape == ref.shape
+    assert np.allclose(stack.todense(), ref.todense())
+
+
+def test_sparse_tiled(lt_ctx):
+    shape = np.array([128, 128])
+    zero = shape / 2
+    a = np.array([27.17, 0.])
+    b = np.array([0., 29.19])
+    indices = np.mgrid[-2:3, -2:3]
+    indices = np.concatenate(indices.T)
+
+    radius = 8
+
+    data, indices, peaks = cbed_frame(*shape, zero, a, b, indices, radius, all_equal=True)
+    data = np.concatenate([data] * 4, axis=0)
+
+    match_pattern = common.patterns.RadialGradient(radius=radius)
+
+    results = []
+    for tileshape in ((1, *shape), (2, 32, 128)):
+        dataset = MemoryDataSet(data=data, tileshape=tileshape,
+                                num_partitions=2, sig_dims=2)
+        m_udf = udf.correlation.SparseCorrelationUDF(
+            match_pattern=match_pattern, peaks=peaks, steps=3
+        )
+        results.append(lt_ctx.run_udf(dataset=dataset, udf=m_udf))
+
+    full, tiled = results
+    assert np.allclose(tiled['refineds'].data, peaks, atol=0.5)
+    assert np.allclose(full['centers'].data, tiled['centers'].data)
+
+
+@pytest.mark.with_numba
+@pytest.mark.parametrize(
+    "cls,correlation_mode", [
+        (udf.correlation.FastCorrelationUDF, 'cc'),
+        (udf.correlation.FastCorrelationUDF, 'hybrid'),
+        (udf.correlation.FastCorrelationUDF, 'phase'),
+        (udf.correlation.FullFrameCorrelationUDF, 'cc'),
+    ]
+)
+def test_correlation_modes(lt_ctx, cls, correlation_mode):
+    shape = np.array([128, 128])
+    zero = shape / 2 + np.random.uniform(-1, 1, size=2)
+    a = np.array([34.3, 0.]) + np.random.uniform(-1, 1, size=2)
+    b = np.array([0., 42.19]) + np.random.uniform(-1, 1, size=2)
+    indices = np.mgrid[-2:3, -2:3]
+    indices = np.concatenate(indices.T)
+
+    radius = 8
+
+    data, indices, peaks = cbed_frame(*shape, zero, a, b, indices, radius)
+
+    dataset = MemoryDataSet(data=data, tileshape=(1, *shape),
+                            num_partitions=1, sig_dims=2)
+
+    match_pattern = common.patterns.RadialGradient(radius=radius, search=radius*1.5)
+
+    m_udf = cls(
+        match_pattern=match_pattern, peaks=peaks.astype(np.int32),
+        correlation_mode=correlation_mode
+    )
+    res = lt_ctx.run_udf(dataset=dataset, udf=m_udf)
+    error = np.abs(peaks - res['refineds'].data[0])
+    print(error)
+
+    # The center of mass refinement of the sharp phase correlation peak
+    # has a systematic error of up to 0.55 px on these lattices
+    # (maximum over 300 random lattices), cross and hybrid correlation
+    # stay below 0.35 px.
+    atol = 0.6 if correlation_mode == 'phase' else 0.5
+    assert np.all(error < atol)
+
+
+@pytest.mark.parametrize(
+    "correlation_mode", ['hybrid', 'phase']
+)
+def test_correlation_mode_fullframe_unsupported(correlation_mode):
+    match_pattern = common.patterns.RadialGradient(radius=4)
+    with pytest.raises(ValueError):
+        udf.correlation.FullFrameCorrelationUDF(
+            peaks=np.array([(8, 8)]), match_pattern=match_pattern,
+            correlation_mode=correlation_mode
+        )
+    with pytest.raises(ValueError):
+        common.correlation.process_frames_full(
+            pattern=match_pattern, frames=np.zeros((1, 16, 16)), peaks=np.array([(8, 8)]),
+            correlation_mode=correlation_mode
+        )
+
+
+def test_correlation_mode_unknown():
+    match_pattern = common.patterns.RadialGradient(radius=4)
+    with pytest.raises(ValueError):
+        udf.correlation.FastCorrelationUDF(
+            peaks=np.array([(8, 8)]), match_pattern=match_pattern, correlation_mode='foo'
+        )